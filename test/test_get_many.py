@@ -0,0 +1,269 @@
+"""
+Exercise tiddler_get_many, which loads tiddlers that
+miss the cache from the cached store in parallel, and
+the get_tiddlers helper that wraps it.
+"""
+import os, shutil
+import threading
+import time
+
+from tiddlyweb.config import config
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store, StoreError, NoTiddlerError, HOOKS
+
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.bag import Bag
+
+from tiddlywebplugins.caching import get_tiddlers
+
+import py.test
+
+
+def setup_module(module):
+    if os.path.exists('store'):
+        shutil.rmtree('store')
+    module.store = Store(config['server_store'][0], config['server_store'][1],
+            environ={'tiddlyweb.config': config})
+    bag = Bag('holder')
+    module.store.put(bag)
+    for i in range(50):
+        tiddler = Tiddler('tiddler%s' % i, 'holder')
+        tiddler.text = 'text%s' % i
+        module.store.put(tiddler)
+    tiddler = Tiddler('revised', 'holder')
+    for i in range(3):
+        tiddler.text = 'rev%s' % (i + 1)
+        module.store.put(tiddler)
+
+
+def setup_function(function):
+    store.storage.mc.flush_all()
+    config.pop('memcache.fetch_concurrency', None)
+
+
+def teardown_function(function):
+    config.pop('memcache.fetch_concurrency', None)
+    store.storage.__dict__.pop('_worker_storage', None)
+    store.storage.cached_storage.__dict__.pop('tiddler_get', None)
+
+
+class FakeStorage(object):
+    """
+    Stand in for the cached store which records how many
+    threads are in tiddler_get at once.
+    """
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    instances = 0
+
+    def __init__(self):
+        FakeStorage.instances += 1
+
+    def tiddler_get(self, tiddler):
+        with FakeStorage.lock:
+            FakeStorage.active += 1
+            FakeStorage.peak = max(FakeStorage.peak, FakeStorage.active)
+        try:
+            time.sleep(0.05)
+            if tiddler.title == 'explode':
+                raise ValueError('explode')
+            if tiddler.title == 'exit':
+                raise SystemExit('exit')
+            if tiddler.title == 'missing':
+                raise NoTiddlerError('missing')
+            tiddler.text = 'fake %s' % tiddler.title
+            return tiddler
+        finally:
+            with FakeStorage.lock:
+                FakeStorage.active -= 1
+
+    @classmethod
+    def reset(cls):
+        cls.active = cls.peak = cls.instances = 0
+
+
+def _tiddlers(count):
+    return [Tiddler('tiddler%s' % i, 'holder') for i in range(count)]
+
+
+def test_get_many_misses():
+    tiddlers = _tiddlers(10)
+    tiddlers.append(Tiddler('missing', 'holder'))
+    results = store.storage.tiddler_get_many(tiddlers)
+
+    assert len(results) == 11
+    for i in range(10):
+        assert results[i].title == 'tiddler%s' % i
+        assert results[i].text == 'text%s' % i
+    assert isinstance(results[10], NoTiddlerError)
+
+    for tiddler in tiddlers:
+        assert store.storage.mc.get(store.storage._tiddler_key(tiddler))
+
+
+def test_get_many_hits():
+    tiddlers = _tiddlers(10)
+    tiddlers.append(Tiddler('missing', 'holder'))
+    store.storage.tiddler_get_many(tiddlers)
+
+    def fail(*args):
+        raise AssertionError('cached store should not be used')
+    store.storage._worker_storage = fail
+    store.storage.cached_storage.tiddler_get = fail
+
+    results = store.storage.tiddler_get_many(_tiddlers(10)
+            + [Tiddler('missing', 'holder')])
+    assert results[3].text == 'text3'
+    assert isinstance(results[10], NoTiddlerError)
+
+
+def test_get_many_no_mixups():
+    # The text store sets serializer.object and then parses into
+    # it. Widen the gap between the two so that a serializer shared
+    # between threads reliably mixes up tiddlers.
+    config['memcache.fetch_concurrency'] = 8
+    original_from_string = Serializer.from_string
+
+    def slow_from_string(self, input_string):
+        time.sleep(0.005)
+        return original_from_string(self, input_string)
+    Serializer.from_string = slow_from_string
+    try:
+        results = store.storage.tiddler_get_many(_tiddlers(50))
+    finally:
+        Serializer.from_string = original_from_string
+    for i, tiddler in enumerate(results):
+        assert tiddler.title == 'tiddler%s' % i
+        assert tiddler.text == 'text%s' % i
+
+    for i in range(50):
+        cached = store.storage.mc.get(store.storage._tiddler_key(
+            Tiddler('tiddler%s' % i, 'holder')))
+        assert cached.title == 'tiddler%s' % i
+        assert cached.text == 'text%s' % i
+
+
+def test_concurrency_limit():
+    config['memcache.fetch_concurrency'] = 3
+    FakeStorage.reset()
+    store.storage._worker_storage = FakeStorage
+    results = store.storage.tiddler_get_many(_tiddlers(12))
+
+    assert FakeStorage.instances == 3
+    assert 1 < FakeStorage.peak <= 3
+    assert results[5].text == 'fake tiddler5'
+
+
+def test_serial_fetch():
+    config['memcache.fetch_concurrency'] = 1
+    FakeStorage.reset()
+    callers = []
+    fake = FakeStorage()
+
+    def tiddler_get(tiddler):
+        callers.append(threading.current_thread())
+        return fake.tiddler_get(tiddler)
+
+    def fail(*args):
+        raise AssertionError('no worker storage should be made')
+    store.storage._worker_storage = fail
+    store.storage.cached_storage.tiddler_get = tiddler_get
+
+    results = store.storage.tiddler_get_many(_tiddlers(4)
+            + [Tiddler('missing', 'holder')])
+    assert callers == [threading.current_thread()] * 5
+    assert FakeStorage.peak == 1
+    assert results[2].text == 'fake tiddler2'
+    assert isinstance(results[4], NoTiddlerError)
+    assert store.storage.mc.get(store.storage._tiddler_key(
+        Tiddler('missing', 'holder'))).text == store.storage._dne_text
+
+
+def test_unexpected_error():
+    config['memcache.fetch_concurrency'] = 4
+    FakeStorage.reset()
+    store.storage._worker_storage = FakeStorage
+    thread_count = threading.active_count()
+
+    tiddlers = _tiddlers(8) + [Tiddler('explode', 'holder')]
+    info = py.test.raises(ValueError, store.storage.tiddler_get_many,
+            tiddlers)
+    assert 'explode' in str(info.value)
+    # the worker's frame is kept in the traceback
+    assert info.traceback[-1].name == 'tiddler_get'
+    assert threading.active_count() == thread_count
+
+
+def test_worker_base_exception():
+    config['memcache.fetch_concurrency'] = 4
+    FakeStorage.reset()
+    store.storage._worker_storage = FakeStorage
+    thread_count = threading.active_count()
+
+    tiddlers = _tiddlers(8) + [Tiddler('exit', 'holder')]
+    py.test.raises(SystemExit, store.storage.tiddler_get_many, tiddlers)
+    assert threading.active_count() == thread_count
+
+
+def test_get_many_revisions():
+    config['memcache.fetch_concurrency'] = 4
+    tiddlers = []
+    for revision in [1, 2, 3]:
+        tiddler = Tiddler('revised', 'holder')
+        tiddler.revision = revision
+        tiddlers.append(tiddler)
+    tiddlers.append(Tiddler('revised', 'holder'))
+
+    results = store.storage.tiddler_get_many(tiddlers)
+    assert [tiddler.text for tiddler in results] == [
+            'rev1', 'rev2', 'rev3', 'rev3']
+
+    cached = store.storage.mc.get(
+            store.storage._tiddler_revision_key(tiddlers[0]))
+    assert cached.text == 'rev1'
+
+
+def test_get_tiddlers():
+    seen = []
+
+    def hook(hook_store, tiddler):
+        seen.append(tiddler.title)
+    HOOKS['tiddler']['get'].append(hook)
+    try:
+        results = get_tiddlers(store, _tiddlers(5)
+                + [Tiddler('missing', 'holder')])
+    finally:
+        HOOKS['tiddler']['get'].remove(hook)
+
+    assert seen == ['tiddler%s' % i for i in range(5)]
+    for tiddler in results[:5]:
+        assert tiddler.store == store
+    assert isinstance(results[5], StoreError)
+
+
+def test_get_tiddlers_special_bag():
+    def retriever(tiddler):
+        tiddler.text = 'special!'
+        return tiddler
+
+    def detector(environ, bag):
+        if bag == '_specialbag':
+            return (None, retriever)
+        return None
+
+    detectors = config.get('special_bag_detectors', [])
+    config['special_bag_detectors'] = [detector]
+    try:
+        special = Tiddler('x', '_specialbag')
+        results = get_tiddlers(store, [Tiddler('tiddler1', 'holder'),
+            special, Tiddler('tiddler2', 'holder')])
+    finally:
+        config['special_bag_detectors'] = detectors
+
+    assert results[0].text == 'text1'
+    assert results[1].text == 'special!'
+    assert results[1].store == store
+    assert results[2].text == 'text2'
+    assert not store.storage.mc.get(store.storage._tiddler_key(special))
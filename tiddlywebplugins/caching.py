@@ -1,5 +1,8 @@
 
 import logging
+import Queue
+import sys
+import threading
 import uuid
 
 from tiddlyweb.store import (Store as StoreBoss, HOOKS,
@@ -7,6 +10,7 @@ from tiddlyweb.store import (Store as StoreBoss, HOOKS,
 from tiddlyweb.stores import StorageInterface
 from tiddlyweb.manage import make_command
 from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.specialbag import get_bag_retriever
 from tiddlyweb.util import sha
 
 from tiddlywebplugins.utils import get_store
@@ -200,38 +204,114 @@ class Store(StorageInterface):
         self.cached_storage.tiddler_delete(tiddler)
 
     def tiddler_get(self, tiddler):
-        if not tiddler.revision or tiddler.revision == 0:
-            key = self._tiddler_key(tiddler)
-        else:
-            key = self._tiddler_revision_key(tiddler)
-        cached_tiddler = self._get(key)
+        key = self._tiddler_get_key(tiddler)
+        cached_tiddler = self._get_cached_tiddler(key, tiddler)
         if cached_tiddler:
-            if cached_tiddler.text == self._dne_text:
-                raise NoTiddlerError('Tiddler %s:%s:%s not found' %
-                        (cached_tiddler.bag,
-                           cached_tiddler.title,
-                           cached_tiddler.revision))
-            LOGGER.debug('satisfying tiddler_get with cache %s:%s',
-                    tiddler.bag, tiddler.title)
-            cached_tiddler.recipe = tiddler.recipe
             tiddler = cached_tiddler
         else:
+            LOGGER.debug('satisfying tiddler_get with data %s:%s',
+                    tiddler.bag, tiddler.title)
             try:
-                LOGGER.debug('satisfying tiddler_get with data %s:%s',
-                        tiddler.bag, tiddler.title)
                 tiddler = self.cached_storage.tiddler_get(tiddler)
-                try:
-                    del tiddler.store
-                except AttributeError:
-                    pass
-                self.mc.set(key, tiddler)
             except StoreError, exc:
-                dne_tiddler = Tiddler(tiddler.title, tiddler.bag)
-                dne_tiddler.text = self._dne_text
-                self.mc.set(key, dne_tiddler)
+                self._set_dne_tiddler(key, tiddler)
                 raise
+            self._set_tiddler(key, tiddler)
         return tiddler
 
+    def tiddler_get_many(self, tiddlers):
+        """
+        Get a list of tiddlers, loading those that miss the cache
+        from the cached store concurrently. The number of threads is
+        limited by memcache.fetch_concurrency in config. Each thread
+        gets its own instance of the cached store, as stores are not
+        expected to be thread safe.
+
+        A list is returned in the same order as tiddlers. Where a
+        tiddler could not be retrieved its entry is the StoreError
+        (usually a NoTiddlerError) that tiddler_get would have raised.
+
+        This is a storage level method: the tiddler get HOOKS are not
+        run and tiddler.store is not set. Use get_tiddlers to have
+        that done.
+        """
+        results = [None] * len(tiddlers)
+        misses = []
+        for index, tiddler in enumerate(tiddlers):
+            key = self._tiddler_get_key(tiddler)
+            try:
+                results[index] = self._get_cached_tiddler(key, tiddler)
+            except NoTiddlerError, exc:
+                results[index] = exc
+            if results[index] is None:
+                misses.append((index, key, tiddler))
+
+        concurrency = min(len(misses),
+                int(self.config.get('memcache.fetch_concurrency', 4)))
+        if concurrency <= 1:
+            for index, key, tiddler in misses:
+                try:
+                    loaded = self.cached_storage.tiddler_get(tiddler)
+                except StoreError, exc:
+                    self._set_dne_tiddler(key, tiddler)
+                    results[index] = exc
+                else:
+                    self._set_tiddler(key, loaded)
+                    results[index] = loaded
+            return results
+
+        LOGGER.debug('satisfying %s tiddler misses with %s threads',
+                len(misses), concurrency)
+        tasks = Queue.Queue()
+        done = Queue.Queue()
+        for miss in misses:
+            tasks.put(miss)
+
+        def worker(storage):
+            while True:
+                try:
+                    index, key, tiddler = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    done.put((index, key, tiddler,
+                        storage.tiddler_get(tiddler), None))
+                except:
+                    done.put((index, key, tiddler, None, sys.exc_info()))
+
+        threads = [threading.Thread(target=worker,
+            args=(self._worker_storage(),)) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+
+        # The memcache client is not shared between threads, so the
+        # cache is populated here as results arrive.
+        unexpected = None
+        try:
+            for _ in misses:
+                index, key, tiddler, loaded, exc_info = done.get()
+                if exc_info is None:
+                    self._set_tiddler(key, loaded)
+                    results[index] = loaded
+                elif issubclass(exc_info[0], StoreError):
+                    self._set_dne_tiddler(key, tiddler)
+                    results[index] = exc_info[1]
+                elif unexpected is None:
+                    unexpected = exc_info
+        finally:
+            # If we are leaving early, stop the workers picking up
+            # any more tasks.
+            while True:
+                try:
+                    tasks.get_nowait()
+                except Queue.Empty:
+                    break
+            for thread in threads:
+                thread.join()
+        if unexpected is not None:
+            raise unexpected[0], unexpected[1], unexpected[2]
+        return results
+
     def tiddler_put(self, tiddler):
         key = self._tiddler_key(tiddler)
         self.mc.delete(key)
@@ -363,6 +443,75 @@ class Store(StorageInterface):
     def _get(self, key):
         return self.mc.get(key)
 
+    def _worker_storage(self):
+        return StoreBoss(self.config['cached_store'][0],
+                self.config['cached_store'][1],
+                environ=self.environ).storage
+
+    def _tiddler_get_key(self, tiddler):
+        if not tiddler.revision or tiddler.revision == 0:
+            return self._tiddler_key(tiddler)
+        return self._tiddler_revision_key(tiddler)
+
+    def _get_cached_tiddler(self, key, tiddler):
+        cached_tiddler = self._get(key)
+        if cached_tiddler:
+            if cached_tiddler.text == self._dne_text:
+                raise NoTiddlerError('Tiddler %s:%s:%s not found' %
+                        (cached_tiddler.bag,
+                           cached_tiddler.title,
+                           cached_tiddler.revision))
+            LOGGER.debug('satisfying tiddler_get with cache %s:%s',
+                    tiddler.bag, tiddler.title)
+            cached_tiddler.recipe = tiddler.recipe
+        return cached_tiddler
+
+    def _set_tiddler(self, key, tiddler):
+        try:
+            del tiddler.store
+        except AttributeError:
+            pass
+        self.mc.set(key, tiddler)
+
+    def _set_dne_tiddler(self, key, tiddler):
+        dne_tiddler = Tiddler(tiddler.title, tiddler.bag)
+        dne_tiddler.text = self._dne_text
+        self.mc.set(key, dne_tiddler)
+
+
+def get_tiddlers(store, tiddlers):
+    """
+    Get a list of tiddlers from store, a StoreBoss, returning a list
+    in the same order where tiddlers that could not be retrieved are
+    represented by their StoreError. If the store is using caching
+    the cache misses are loaded concurrently, otherwise the tiddlers
+    are retrieved one at a time. Tiddlers in special bags are always
+    retrieved with store.get. In either case tiddler.store is set
+    and the tiddler get HOOKS are run, as with store.get.
+    """
+    results = [None] * len(tiddlers)
+    many = []
+    for index, tiddler in enumerate(tiddlers):
+        if (hasattr(store.storage, 'tiddler_get_many')
+                and not get_bag_retriever(store.environ, tiddler.bag)):
+            many.append(index)
+            continue
+        try:
+            results[index] = store.get(tiddler)
+        except StoreError, exc:
+            results[index] = exc
+
+    if many:
+        loaded = store.storage.tiddler_get_many(
+                [tiddlers[index] for index in many])
+        for index, tiddler in zip(many, loaded):
+            if not isinstance(tiddler, StoreError):
+                tiddler.store = store
+                for hook in HOOKS['tiddler']['get']:
+                    hook(store, tiddler)
+            results[index] = tiddler
+    return results
+
 
 def init(config):
 